@@ -1,13 +1,182 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, has_request_context
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from concurrent import futures
+from functools import wraps
+from types import SimpleNamespace
 import requests
 import time
 import sqlite3
 import math
+import hashlib
+import threading
+import sys
+import os
+import json
 
 app = Flask(__name__)
 
 DB_PATH = "localizacoes.db"
 
+# ==============================
+# Rastreamento de latência (Server-Timing)
+# ==============================
+_rastro_thread = threading.local()
+
+def contexto_rastro():
+    """Rastro da requisição atual ou, em threads auxiliares, o vinculado com vincular_rastro"""
+    if has_request_context() and "rastro" in g:
+        return g
+    return getattr(_rastro_thread, "contexto", None)
+
+def vincular_rastro(rastro, inicio):
+    """Faz as chamadas @medir desta thread registrarem em `rastro` (None desvincula)"""
+    if rastro is None:
+        _rastro_thread.contexto = None
+    else:
+        _rastro_thread.contexto = SimpleNamespace(rastro=rastro, rastro_nivel=0, rastro_inicio=inicio)
+
+def mesclar_rastro(rastro, inicio):
+    """Copia para o rastro da requisição atual as chamadas registradas por outra thread"""
+    deslocamento_ms = (inicio - g.rastro_inicio) * 1000
+    for chamada in list(rastro):
+        g.rastro.append(dict(chamada, inicio_ms=round(chamada["inicio_ms"] + deslocamento_ms, 2)))
+
+def medir(func):
+    """Registra a duração de cada chamada no rastro da requisição atual"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        contexto = contexto_rastro()
+        if contexto is None:
+            return func(*args, **kwargs)
+        inicio = time.perf_counter()
+        contexto.rastro_nivel += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            contexto.rastro_nivel -= 1
+            contexto.rastro.append({
+                "nome": func.__name__,
+                "nivel": contexto.rastro_nivel,
+                "inicio_ms": round((inicio - contexto.rastro_inicio) * 1000, 2),
+                "dur_ms": round((time.perf_counter() - inicio) * 1000, 2)
+            })
+    return wrapper
+
+def cabecalho_server_timing(rastro, total_ms):
+    totais = {}
+    for chamada in rastro:
+        dur, qtd = totais.get(chamada["nome"], (0, 0))
+        totais[chamada["nome"]] = (dur + chamada["dur_ms"], qtd + 1)
+    metricas = [
+        f'{nome};dur={dur:.2f};desc="{qtd}x"'
+        for nome, (dur, qtd) in totais.items()
+    ]
+    metricas.append(f"total;dur={total_ms:.2f}")
+    return ", ".join(metricas)
+
+# ==============================
+# Profiler por amostragem
+# ==============================
+class AmostradorPilha(threading.Thread):
+    """Amostra periodicamente a pilha de threads e acumula em formato folded (flame graph)"""
+
+    def __init__(self, thread_id, intervalo):
+        super().__init__(daemon=True)
+        self.thread_ids = {thread_id}
+        self.intervalo = intervalo
+        self.pilhas = Counter()
+        self._parar = threading.Event()
+
+    def acompanhar(self, thread_id):
+        """Inclui outra thread que trabalha para a mesma requisição"""
+        self.thread_ids.add(thread_id)
+
+    def run(self):
+        while not self._parar.wait(self.intervalo):
+            frames = sys._current_frames()
+            for thread_id in list(self.thread_ids):
+                frame = frames.get(thread_id)
+                pilha = []
+                while frame is not None:
+                    codigo = frame.f_code
+                    pilha.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})")
+                    frame = frame.f_back
+                if pilha:
+                    self.pilhas[";".join(reversed(pilha))] += 1
+
+    def parar(self):
+        self._parar.set()
+        self.join()
+        return self.pilhas
+
+_profiler = {"restantes": 0, "intervalo": 0.005, "pilhas": Counter()}
+_profiler_lock = threading.Lock()
+
+@app.before_request
+def iniciar_rastro():
+    g.rastro = []
+    g.rastro_nivel = 0
+    g.rastro_inicio = time.perf_counter()
+
+    with _profiler_lock:
+        amostrar = _profiler["restantes"] > 0
+        if amostrar:
+            _profiler["restantes"] -= 1
+            intervalo = _profiler["intervalo"]
+    if amostrar:
+        g.amostrador = AmostradorPilha(threading.get_ident(), intervalo)
+        g.amostrador.start()
+
+@app.after_request
+def finalizar_rastro(resp):
+    if "rastro" not in g:
+        return resp
+    total_ms = (time.perf_counter() - g.rastro_inicio) * 1000
+    resp.headers["Server-Timing"] = cabecalho_server_timing(g.rastro, total_ms)
+
+    if request.args.get("debug") == "1" and resp.status_code == 200 and resp.is_json:
+        dados = resp.get_json()
+        if isinstance(dados, dict):
+            dados["_debug"] = {"total_ms": round(total_ms, 2), "chamadas": g.rastro}
+            resp.set_data(jsonify(dados).get_data())
+            # O corpo muda, então o ETag não vale mais
+            resp.headers.pop("ETag", None)
+    return resp
+
+@app.teardown_request
+def finalizar_amostragem(exc):
+    amostrador = g.pop("amostrador", None)
+    if amostrador:
+        pilhas = amostrador.parar()
+        with _profiler_lock:
+            _profiler["pilhas"].update(pilhas)
+
+@app.route("/profiler", methods=["GET"])
+def profiler_resultado():
+    """Pilhas acumuladas no formato folded (flamegraph.pl, speedscope)"""
+    with _profiler_lock:
+        linhas = [f"{pilha} {qtd}" for pilha, qtd in _profiler["pilhas"].most_common()]
+    return "\n".join(linhas) + "\n", 200, {"Content-Type": "text/plain; charset=utf-8"}
+
+@app.route("/profiler", methods=["POST"])
+def profiler_ativar():
+    data = request.json or {}
+    try:
+        requisicoes = int(data.get("requisicoes", 10))
+        intervalo_ms = float(data.get("intervalo_ms", 5))
+    except (TypeError, ValueError):
+        return jsonify({"erro": "Parâmetros inválidos"}), 400
+    if requisicoes < 0 or intervalo_ms <= 0:
+        return jsonify({"erro": "Parâmetros inválidos"}), 400
+
+    with _profiler_lock:
+        _profiler["restantes"] = requisicoes
+        _profiler["intervalo"] = intervalo_ms / 1000
+        if data.get("limpar"):
+            _profiler["pilhas"].clear()
+    return jsonify({"status": "ok", "requisicoes": requisicoes, "intervalo_ms": intervalo_ms})
+
 # ==============================
 # DEBUG
 # ==============================
@@ -38,28 +207,74 @@ def init_db():
                 timestamp INTEGER,
                 rua_cache TEXT,
                 rua_cache_ts INTEGER,
-                estado_movimento TEXT
+                estado_movimento TEXT,
+                geohash TEXT,
+                vel_norte REAL,
+                vel_leste REAL,
+                var_vel REAL
             )
         """)
+        # Bancos criados antes do índice geohash e da previsão de posição
+        colunas = {c[1] for c in conn.execute("PRAGMA table_info(ultima_posicao)")}
+        for coluna, tipo in [("geohash", "TEXT"), ("vel_norte", "REAL"),
+                             ("vel_leste", "REAL"), ("var_vel", "REAL")]:
+            if coluna not in colunas:
+                conn.execute(f"ALTER TABLE ultima_posicao ADD COLUMN {coluna} {tipo}")
+        pendentes = conn.execute("""
+            SELECT nome, lat, lon FROM ultima_posicao
+            WHERE geohash IS NULL AND lat IS NOT NULL AND lon IS NOT NULL
+        """).fetchall()
+        conn.executemany(
+            "UPDATE ultima_posicao SET geohash = ? WHERE nome = ?",
+            [(geohash_codificar(lat, lon), nome) for nome, lat, lon in pendentes]
+        )
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_ultima_posicao_geohash
+            ON ultima_posicao (geohash)
+        """)
         conn.execute("""
             CREATE TABLE IF NOT EXISTS regioes (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 nome TEXT UNIQUE,
                 lat REAL NOT NULL,
                 lon REAL NOT NULL,
-                raio_metros REAL NOT NULL
+                raio_metros REAL NOT NULL,
+                poligono TEXT
+            )
+        """)
+        # Bancos criados antes das regiões poligonais
+        colunas = {c[1] for c in conn.execute("PRAGMA table_info(regioes)")}
+        if "poligono" not in colunas:
+            conn.execute("ALTER TABLE regioes ADD COLUMN poligono TEXT")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS local_resolvido (
+                nome TEXT PRIMARY KEY,
+                lat REAL NOT NULL,
+                lon REAL NOT NULL,
+                cog REAL,
+                local TEXT,
+                poi_frente TEXT,
+                resolvido_em INTEGER
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS metadados (
+                chave TEXT PRIMARY KEY,
+                valor INTEGER NOT NULL
             )
         """)
         conn.commit()
 
+@medir
 def salvar_posicao(nome, data):
     with sqlite3.connect(DB_PATH) as conn:
         conn.execute("""
             INSERT INTO ultima_posicao (
                 nome, lat, lon, vel, cog, batt,
-                timestamp, rua_cache, rua_cache_ts, estado_movimento
+                timestamp, rua_cache, rua_cache_ts, estado_movimento, geohash,
+                vel_norte, vel_leste, var_vel
             )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ON CONFLICT(nome) DO UPDATE SET
                 lat=excluded.lat,
                 lon=excluded.lon,
@@ -69,7 +284,11 @@ def salvar_posicao(nome, data):
                 timestamp=excluded.timestamp,
                 rua_cache=excluded.rua_cache,
                 rua_cache_ts=excluded.rua_cache_ts,
-                estado_movimento=excluded.estado_movimento
+                estado_movimento=excluded.estado_movimento,
+                geohash=excluded.geohash,
+                vel_norte=excluded.vel_norte,
+                vel_leste=excluded.vel_leste,
+                var_vel=excluded.var_vel
         """, (
             nome,
             data["lat"],
@@ -80,10 +299,16 @@ def salvar_posicao(nome, data):
             data["timestamp"],
             data.get("rua_cache"),
             data.get("rua_cache_ts"),
-            data.get("estado_movimento")
+            data.get("estado_movimento"),
+            geohash_codificar(data["lat"], data["lon"])
+            if data["lat"] is not None and data["lon"] is not None else None,
+            data.get("vel_norte"),
+            data.get("vel_leste"),
+            data.get("var_vel")
         ))
         conn.commit()
 
+@medir
 def buscar_posicao(nome):
     with sqlite3.connect(DB_PATH) as conn:
         conn.row_factory = sqlite3.Row
@@ -91,29 +316,110 @@ def buscar_posicao(nome):
         row = cur.fetchone()
         return dict(row) if row else None
 
-def salvar_regiao(nome, lat, lon, raio_metros=40):
+@medir
+def buscar_local_resolvido(nome):
+    with sqlite3.connect(DB_PATH) as conn:
+        conn.row_factory = sqlite3.Row
+        cur = conn.execute("SELECT * FROM local_resolvido WHERE nome = ?", (nome,))
+        row = cur.fetchone()
+        return dict(row) if row else None
+
+@medir
+def salvar_local_resolvido(nome, lat, lon, cog, local, poi_frente):
     with sqlite3.connect(DB_PATH) as conn:
         conn.execute("""
-            INSERT INTO regioes (nome, lat, lon, raio_metros)
-            VALUES (?, ?, ?, ?)
+            INSERT INTO local_resolvido (nome, lat, lon, cog, local, poi_frente, resolvido_em)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
             ON CONFLICT(nome) DO UPDATE SET
                 lat=excluded.lat,
                 lon=excluded.lon,
-                raio_metros=excluded.raio_metros
-        """, (nome, lat, lon, raio_metros))
+                cog=excluded.cog,
+                local=excluded.local,
+                poi_frente=excluded.poi_frente,
+                resolvido_em=excluded.resolvido_em
+        """, (nome, lat, lon, cog, local, poi_frente, int(time.time())))
         conn.commit()
 
-def verificar_regioes(lat, lon):
+@medir
+def buscar_proximos(nome, lat, lon, raio_metros):
+    """
+    Pessoas a até raio_metros do ponto, ordenadas por distância.
+    Só lê as células geohash que cobrem o raio (faixas no índice da coluna geohash).
+    """
+    prefixos = geohash_celulas_cobrindo(lat, lon, raio_metros)
+    condicoes = " OR ".join(["(geohash >= ? AND geohash < ?)"] * len(prefixos))
+    parametros = []
+    for prefixo in prefixos:
+        parametros += [prefixo, prefixo + "{"]  # "{" vem logo após "z" em ASCII
+
     with sqlite3.connect(DB_PATH) as conn:
         conn.row_factory = sqlite3.Row
-        cur = conn.execute("SELECT * FROM regioes")
-        regioes = cur.fetchall()
+        cur = conn.execute(
+            f"SELECT nome, lat, lon, timestamp, estado_movimento FROM ultima_posicao WHERE {condicoes}",
+            parametros
+        )
+        candidatos = cur.fetchall()
+
     resultado = []
-    for r in regioes:
-        if distancia_metros(lat, lon, r["lat"], r["lon"]) <= r["raio_metros"]:
-            resultado.append(r["nome"])
+    for r in candidatos:
+        if r["nome"] == nome:
+            continue
+        dist = distancia_metros(lat, lon, r["lat"], r["lon"])
+        if dist <= raio_metros:
+            pessoa = dict(r)
+            pessoa["distancia_metros"] = round(dist)
+            resultado.append(pessoa)
+    resultado.sort(key=lambda p: p["distancia_metros"])
     return resultado
 
+@medir
+def salvar_regiao(nome, lat, lon, raio_metros=40):
+    gravar_regiao(nome, lat, lon, raio_metros, None)
+
+@medir
+def salvar_regiao_poligono(nome, pontos):
+    """
+    Salva uma região poligonal a partir de uma lista de [lat, lon].
+    lat/lon/raio_metros guardam o centro e o raio do círculo que envolve o polígono.
+    """
+    centro_lat = sum(p[0] for p in pontos) / len(pontos)
+    centro_lon = sum(p[1] for p in pontos) / len(pontos)
+    raio = max(distancia_metros(centro_lat, centro_lon, p[0], p[1]) for p in pontos)
+    gravar_regiao(nome, centro_lat, centro_lon, raio, json.dumps(pontos))
+
+def gravar_regiao(nome, lat, lon, raio_metros, poligono):
+    with sqlite3.connect(DB_PATH) as conn:
+        conn.execute("""
+            INSERT INTO regioes (nome, lat, lon, raio_metros, poligono)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(nome) DO UPDATE SET
+                lat=excluded.lat,
+                lon=excluded.lon,
+                raio_metros=excluded.raio_metros,
+                poligono=excluded.poligono
+        """, (nome, lat, lon, raio_metros, poligono))
+        # Versão das regiões: invalida ETags, cache de respostas e índice de regiões
+        conn.execute("""
+            INSERT INTO metadados (chave, valor) VALUES ('regioes_versao', 1)
+            ON CONFLICT(chave) DO UPDATE SET valor = valor + 1
+        """)
+        conn.commit()
+
+@medir
+def versao_regioes():
+    """Retorna a versão das regiões salvas (incrementada a cada alteração)"""
+    with sqlite3.connect(DB_PATH) as conn:
+        cur = conn.execute("SELECT valor FROM metadados WHERE chave = 'regioes_versao'")
+        row = cur.fetchone()
+    return row[0] if row else 0
+
+@medir
+def verificar_regioes(lat, lon):
+    """Nomes das regiões que contêm o ponto, da mais específica (menor área) para a maior"""
+    if lat is None or lon is None:
+        return []
+    return obter_indice_regioes().consultar(lat, lon)
+
 # ==============================
 # Utilidades
 # ==============================
@@ -130,6 +436,91 @@ def distancia_metros(lat1, lon1, lat2, lon2):
     )
     return 2 * R * math.atan2(math.sqrt(a), math.sqrt(1 - a))
 
+def coordenada_valida(lat, lon):
+    return math.isfinite(lat) and math.isfinite(lon) and -90 <= lat <= 90 and -180 <= lon <= 180
+
+def rumo_graus(lat1, lon1, lat2, lon2):
+    """Rumo inicial de (lat1, lon1) para (lat2, lon2), em graus a partir do norte"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dlambda = math.radians(lon2 - lon1)
+    x = math.sin(dlambda) * math.cos(phi2)
+    y = math.cos(phi1) * math.sin(phi2) - math.sin(phi1) * math.cos(phi2) * math.cos(dlambda)
+    return math.degrees(math.atan2(x, y)) % 360
+
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISAO = 9  # ~5 m
+
+def geohash_codificar(lat, lon, precisao=GEOHASH_PRECISAO):
+    lat_min, lat_max = -90.0, 90.0
+    lon_min, lon_max = -180.0, 180.0
+    resultado = []
+    bits = 0
+    valor = 0
+    par = True
+    while len(resultado) < precisao:
+        if par:
+            meio = (lon_min + lon_max) / 2
+            if lon >= meio:
+                valor = (valor << 1) | 1
+                lon_min = meio
+            else:
+                valor <<= 1
+                lon_max = meio
+        else:
+            meio = (lat_min + lat_max) / 2
+            if lat >= meio:
+                valor = (valor << 1) | 1
+                lat_min = meio
+            else:
+                valor <<= 1
+                lat_max = meio
+        par = not par
+        bits += 1
+        if bits == 5:
+            resultado.append(GEOHASH_BASE32[valor])
+            bits = 0
+            valor = 0
+    return "".join(resultado)
+
+def geohash_tamanho_celula(precisao):
+    """Retorna (altura, largura) em graus de uma célula geohash"""
+    bits = 5 * precisao
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+def geohash_celulas_cobrindo(lat, lon, raio_metros):
+    """
+    Prefixos geohash que cobrem o círculo. A precisão é a mais fina cuja célula
+    ainda é maior que o raio, então bastam no máximo 3x3 células.
+    """
+    cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+    precisao = 1
+    for p in range(GEOHASH_PRECISAO, 0, -1):
+        altura, largura = geohash_tamanho_celula(p)
+        if altura * 111320 >= raio_metros and largura * 111320 * cos_lat >= raio_metros:
+            precisao = p
+            break
+
+    altura, largura = geohash_tamanho_celula(precisao)
+    dlat = raio_metros / 111320
+    dlon = raio_metros / (111320 * cos_lat)
+    lat_min, lat_max = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+    lon_min, lon_max = max(lon - dlon, -180.0), min(lon + dlon, 180.0)
+
+    # Amostra a bounding box em meios passos de célula, incluindo as bordas
+    passo_lat = altura / 2
+    passo_lon = largura / 2
+    n_lat = math.ceil((lat_max - lat_min) / passo_lat)
+    n_lon = math.ceil((lon_max - lon_min) / passo_lon)
+
+    prefixos = set()
+    for i in range(n_lat + 1):
+        y = min(lat_min + i * passo_lat, lat_max)
+        for j in range(n_lon + 1):
+            x = min(lon_min + j * passo_lon, lon_max)
+            prefixos.add(geohash_codificar(y, x, precisao))
+    return sorted(prefixos)
+
 def formatar_tempo(segundos):
     if segundos < 120:
         return "agora"
@@ -143,9 +534,170 @@ def formatar_tempo(segundos):
         texto += f" e {resto} minuto{'s' if resto != 1 else ''}"
     return texto
 
+# ==============================
+# Índice de regiões
+# ==============================
+CELULA_GRAUS = 0.01  # ~1,1 km
+MAX_CELULAS_POR_REGIAO = 10000
+METROS_POR_GRAU = 111320
+
+class IndiceRegioes:
+    """
+    Índice em grade das bounding boxes das regiões (círculos e polígonos).
+    Os polígonos são pré-processados em arestas (y1, y2, x1, inclinação)
+    para o teste de ponto em polígono por ray casting.
+    """
+
+    def __init__(self, regioes):
+        self.celulas = {}
+        self.grandes = []
+
+        for r in regioes:
+            # Uma região com geometria inválida é ignorada, sem derrubar o índice inteiro
+            try:
+                if r["poligono"]:
+                    pontos = json.loads(r["poligono"])
+                    item = self._preparar_poligono(r["nome"], pontos)
+                else:
+                    item = self._preparar_circulo(r["nome"], r["lat"], r["lon"], r["raio_metros"])
+            except (TypeError, ValueError, IndexError, ZeroDivisionError) as e:
+                print(f"Região '{r['nome']}' ignorada no índice:", e)
+                continue
+            if not all(math.isfinite(v) for v in item["bbox"]):
+                print(f"Região '{r['nome']}' ignorada no índice: coordenadas não finitas")
+                continue
+
+            min_lat, min_lon, max_lat, max_lon = item["bbox"]
+            linhas = range(math.floor(min_lat / CELULA_GRAUS), math.floor(max_lat / CELULA_GRAUS) + 1)
+            colunas = range(math.floor(min_lon / CELULA_GRAUS), math.floor(max_lon / CELULA_GRAUS) + 1)
+            if len(linhas) * len(colunas) > MAX_CELULAS_POR_REGIAO:
+                self.grandes.append(item)
+                continue
+            for i in linhas:
+                for j in colunas:
+                    self.celulas.setdefault((i, j), []).append(item)
+
+    @staticmethod
+    def _preparar_circulo(nome, lat, lon, raio):
+        dlat = raio / METROS_POR_GRAU
+        dlon = raio / (METROS_POR_GRAU * max(math.cos(math.radians(lat)), 1e-6))
+        return {
+            "nome": nome,
+            "area": math.pi * raio * raio,
+            "bbox": (lat - dlat, lon - dlon, lat + dlat, lon + dlon),
+            "contem": lambda p_lat, p_lon: distancia_metros(p_lat, p_lon, lat, lon) <= raio
+        }
+
+    @staticmethod
+    def _preparar_poligono(nome, pontos):
+        arestas = []
+        for (y1, x1), (y2, x2) in zip(pontos, pontos[1:] + pontos[:1]):
+            if y1 != y2:
+                arestas.append((y1, y2, x1, (x2 - x1) / (y2 - y1)))
+
+        def contem(lat, lon):
+            dentro = False
+            for y1, y2, x1, inclinacao in arestas:
+                if (y1 > lat) != (y2 > lat) and lon < x1 + (lat - y1) * inclinacao:
+                    dentro = not dentro
+            return dentro
+
+        # Área pela fórmula do laço, em projeção equiretangular local
+        lat_media = sum(p[0] for p in pontos) / len(pontos)
+        escala_lon = METROS_POR_GRAU * math.cos(math.radians(lat_media))
+        area = abs(sum(
+            (x1 * escala_lon) * (y2 * METROS_POR_GRAU) - (x2 * escala_lon) * (y1 * METROS_POR_GRAU)
+            for (y1, x1), (y2, x2) in zip(pontos, pontos[1:] + pontos[:1])
+        )) / 2
+
+        lats = [p[0] for p in pontos]
+        lons = [p[1] for p in pontos]
+        return {
+            "nome": nome,
+            "area": area,
+            "bbox": (min(lats), min(lons), max(lats), max(lons)),
+            "contem": contem
+        }
+
+    def consultar(self, lat, lon):
+        chave = (math.floor(lat / CELULA_GRAUS), math.floor(lon / CELULA_GRAUS))
+        encontradas = []
+        for item in self.celulas.get(chave, []) + self.grandes:
+            min_lat, min_lon, max_lat, max_lon = item["bbox"]
+            if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon and item["contem"](lat, lon):
+                encontradas.append(item)
+        encontradas.sort(key=lambda item: item["area"])
+        return [item["nome"] for item in encontradas]
+
+_indice_regioes = {"versao": None, "indice": None}
+_indice_lock = threading.Lock()
+
+def obter_indice_regioes():
+    """Reconstrói o índice apenas quando a versão das regiões muda"""
+    versao = versao_regioes()
+    with _indice_lock:
+        if _indice_regioes["versao"] != versao:
+            with sqlite3.connect(DB_PATH) as conn:
+                conn.row_factory = sqlite3.Row
+                cur = conn.execute("SELECT * FROM regioes")
+                _indice_regioes["indice"] = IndiceRegioes(cur.fetchall())
+            _indice_regioes["versao"] = versao
+        return _indice_regioes["indice"]
+
+# ==============================
+# Cache de respostas e GET condicional
+# ==============================
+CACHE_WHERE_TTL = 60 * 60
+CACHE_DETALHES_TTL = 30
+CACHE_MAX_ENTRADAS = 1000
+
+_cache_respostas = {}
+_cache_lock = threading.Lock()
+
+def cache_obter(chave, versao):
+    with _cache_lock:
+        item = _cache_respostas.get(chave)
+    if not item:
+        return None
+    item_versao, expira_em, valor = item
+    if item_versao != versao or expira_em < time.time():
+        return None
+    return valor
+
+def cache_salvar(chave, versao, valor, ttl):
+    agora = time.time()
+    with _cache_lock:
+        if chave not in _cache_respostas and len(_cache_respostas) >= CACHE_MAX_ENTRADAS:
+            expirados = [k for k, v in _cache_respostas.items() if v[1] < agora]
+            for k in expirados:
+                del _cache_respostas[k]
+            if len(_cache_respostas) >= CACHE_MAX_ENTRADAS:
+                # Remove a entrada mais antiga
+                del _cache_respostas[next(iter(_cache_respostas))]
+        _cache_respostas[chave] = (versao, agora + ttl, valor)
+
+def gerar_etag(*partes):
+    return hashlib.sha1("|".join(str(p) for p in partes).encode("utf-8")).hexdigest()[:20]
+
+def nao_modificado(etag):
+    """
+    Avalia If-None-Match da requisição atual. Não há Last-Modified: o tst vem do
+    dispositivo e relatos enfileirados chegam com horários antigos, então só o
+    ETag identifica a versão da resposta.
+    """
+    return bool(request.if_none_match) and request.if_none_match.contains_weak(etag)
+
+def resposta_condicional(payload, etag):
+    """Resposta JSON com ETag, ou 304 vazio se payload for None"""
+    resp = jsonify(payload) if payload is not None else app.response_class(status=304)
+    resp.set_etag(etag)
+    resp.cache_control.no_cache = True
+    return resp
+
 # ==============================
 # Reverse Geocoding com POI
 # ==============================
+@medir
 def latlon_para_rua(lat, lon):
     try:
         url = "https://nominatim.openstreetmap.org/reverse"
@@ -193,6 +745,7 @@ def latlon_para_rua(lat, lon):
     except:
         return None
 
+@medir
 def extrair_bairro(lat, lon):
     """Extrai apenas o bairro da coordenada usando Nominatim"""
     try:
@@ -208,6 +761,7 @@ def extrair_bairro(lat, lon):
     except:
         return None
 
+@medir
 def buscar_poi_em_raio(lat, lon, raio_metros):
     """Busca POI usando Overpass API do OpenStreetMap"""
     try:
@@ -349,6 +903,7 @@ def grau_para_direcao(cog):
 # ==============================
 # Próximo POI à frente
 # ==============================
+@medir
 def proximo_poi(lat, lon, cog):
     """Busca o próximo POI na direção do movimento usando Overpass API"""
     # Projeção para frente em diferentes distâncias
@@ -379,6 +934,7 @@ def proximo_poi(lat, lon, cog):
 # ==============================
 # Determinar local com prioridade
 # ==============================
+@medir
 def buscar_poi_prioritario(lat, lon, raio_metros):
     """Busca apenas POIs prioritários (shopping, transporte, hospitais, etc) - excluindo supermercados e restaurantes"""
     try:
@@ -493,6 +1049,7 @@ def buscar_poi_prioritario(lat, lon, raio_metros):
         print(f"Erro ao buscar POI prioritário: {e}")
         return None
 
+@medir
 def buscar_poi_secundario(lat, lon, raio_metros):
     """Busca apenas POIs secundários (supermercados e restaurantes/cafés)"""
     try:
@@ -544,6 +1101,7 @@ def buscar_poi_secundario(lat, lon, raio_metros):
         print(f"Erro ao buscar POI secundário: {e}")
         return None
 
+@medir
 def determinar_local_prioritario(lat, lon):
     """
     Retorna o local seguindo a ordem de prioridade:
@@ -577,37 +1135,18 @@ def determinar_local_prioritario(lat, lon):
     return latlon_para_rua(lat, lon) or "essa região"
 
 # ==============================
-# Webhook OwnTracks
+# Movimento
 # ==============================
-@app.route("/", methods=["POST"])
-def owntracks_webhook():
-    data = request.json or {}
-    if data.get("_type") != "location":
-        return jsonify({"status": "ok"})
-
-    agora = int(time.time())
-    CACHE_RUA_MAX = 15 * 60
-
-    topic = data.get("topic", "")
-    partes = topic.split("/")
-    if len(partes) < 3:
-        return jsonify({"erro": "Topic inválido"}), 400
-
-    nome = partes[2].lower()
-    lat = data.get("lat")
-    lon = data.get("lon")
-    vel_ot_ms = data.get("vel", 0) or 0
-    cog = data.get("cog", 0)
-    batt = data.get("batt")
-    timestamp = data.get("tst", agora)
-
-    anterior = buscar_posicao(nome)
-    rua_cache = anterior.get("rua_cache") if anterior else None
-    rua_cache_ts = anterior.get("rua_cache_ts") if anterior else None
+def calcular_movimento(anterior, lat, lon, vel_ot_ms, timestamp):
+    """
+    Calcula velocidade final e estado de movimento a partir da posição anterior.
+    Retorna (vel_final_ms, estado_movimento, dist); dist é None quando não há
+    posição anterior válida para comparar.
+    """
     estado_anterior = anterior.get("estado_movimento") if anterior else "parado"
-
     vel_final_ms = vel_ot_ms
     estado_movimento = estado_anterior
+    dist = None
 
     if anterior:
         dt = timestamp - anterior["timestamp"]
@@ -639,19 +1178,130 @@ def owntracks_webhook():
                 else:
                     estado_movimento = "movimento"
 
-            precisa_atualizar_rua = False
-            if dist > 50 or not rua_cache_ts or (agora - rua_cache_ts) > CACHE_RUA_MAX:
-                precisa_atualizar_rua = True
-            if precisa_atualizar_rua:
-                novo_local = latlon_para_rua(lat, lon)
-                if novo_local:
-                    rua_cache = novo_local
-                    rua_cache_ts = agora
+    return vel_final_ms, estado_movimento, dist
+
+# ==============================
+# Previsão de posição
+# ==============================
+# Filtro de Kalman simplificado sobre o vetor velocidade (norte/leste, m/s),
+# com uma variância escalar compartilhada pelos dois eixos.
+VAR_MEDICAO_VEL = 0.25      # (m/s)²
+RUIDO_PROCESSO_VEL = 0.002  # (m/s)² por segundo
+PRECISAO_BASE_METROS = 50
+PREVISAO_MAX_SEG = 15 * 60
+PREVISAO_PASSO_SEG = 30
+
+def atualizar_previsao(anterior, lat, lon, vel_ms, cog, estado_movimento, timestamp):
+    """
+    Incorpora a nova leitura ao filtro. Retorna vel_norte, vel_leste e var_vel.
+    Sem cog, a direção vem do rumo entre a leitura anterior e esta; sem leitura
+    anterior, a medida fica em zero com variância ampliada pela velocidade.
+    """
+    var_medicao = VAR_MEDICAO_VEL
+    if estado_movimento == "parado":
+        medida_norte, medida_leste = 0.0, 0.0
+    else:
+        origem = (anterior.get("lat"), anterior.get("lon")) if anterior else (None, None)
+        if cog is None and None not in origem and origem != (lat, lon):
+            cog = rumo_graus(origem[0], origem[1], lat, lon)
+        if cog is None:
+            # Direção desconhecida: o vetor pode estar em qualquer ponto do círculo de raio vel_ms
+            medida_norte, medida_leste = 0.0, 0.0
+            var_medicao += vel_ms ** 2 / 2
+        else:
+            rad = math.radians(cog)
+            medida_norte = vel_ms * math.cos(rad)
+            medida_leste = vel_ms * math.sin(rad)
+
+    if not anterior or anterior.get("var_vel") is None:
+        return {"vel_norte": medida_norte, "vel_leste": medida_leste, "var_vel": var_medicao}
+
+    dt = max(timestamp - anterior["timestamp"], 0)
+    variancia = anterior["var_vel"] + RUIDO_PROCESSO_VEL * dt
+    ganho = variancia / (variancia + var_medicao)
+    return {
+        "vel_norte": anterior["vel_norte"] + ganho * (medida_norte - anterior["vel_norte"]),
+        "vel_leste": anterior["vel_leste"] + ganho * (medida_leste - anterior["vel_leste"]),
+        "var_vel": (1 - ganho) * variancia
+    }
+
+def estimar_posicao(pos, instante):
+    """
+    Estima a posição em `instante` por dead reckoning a partir da última leitura.
+    O tempo é arredondado para baixo em passos de PREVISAO_PASSO_SEG e limitado a
+    PREVISAO_MAX_SEG; o resultado é arredondado, então a resposta fica estável e
+    cacheável. Parado, a estimativa é a própria leitura e o raio não cresce.
+    Retorna (lat, lon, raio_confianca_metros).
+    """
+    if pos.get("estado_movimento") == "parado":
+        return round(pos["lat"], 5), round(pos["lon"], 5), PRECISAO_BASE_METROS
+
+    dt = min(max(instante - pos["timestamp"], 0), PREVISAO_MAX_SEG)
+    dt -= dt % PREVISAO_PASSO_SEG
+
+    vel_norte = pos.get("vel_norte") or 0
+    vel_leste = pos.get("vel_leste") or 0
+    variancia = pos.get("var_vel")
+    if variancia is None:
+        variancia = VAR_MEDICAO_VEL
+    variancia += RUIDO_PROCESSO_VEL * dt
+
+    lat = pos["lat"] + vel_norte * dt / 111320
+    lon = pos["lon"] + vel_leste * dt / (111320 * max(math.cos(math.radians(pos["lat"])), 1e-6))
+    raio = PRECISAO_BASE_METROS + math.sqrt(variancia) * dt
+    return round(lat, 5), round(lon, 5), round(raio)
+
+# ==============================
+# Webhook OwnTracks
+# ==============================
+@app.route("/", methods=["POST"])
+def owntracks_webhook():
+    data = request.json or {}
+    if data.get("_type") != "location":
+        return jsonify({"status": "ok"})
+
+    agora = int(time.time())
+    CACHE_RUA_MAX = 15 * 60
+
+    topic = data.get("topic", "")
+    partes = topic.split("/")
+    if len(partes) < 3:
+        return jsonify({"erro": "Topic inválido"}), 400
+
+    nome = partes[2].lower()
+    lat = data.get("lat")
+    lon = data.get("lon")
+    vel_ot_ms = data.get("vel", 0) or 0
+    cog = data.get("cog", 0)
+    batt = data.get("batt")
+    timestamp = data.get("tst", agora)
+
+    anterior = buscar_posicao(nome)
+    rua_cache = anterior.get("rua_cache") if anterior else None
+    rua_cache_ts = anterior.get("rua_cache_ts") if anterior else None
+
+    vel_final_ms, estado_movimento, dist = calcular_movimento(
+        anterior, lat, lon, vel_ot_ms, timestamp
+    )
+
+    if dist is not None:
+        precisa_atualizar_rua = False
+        if dist > 50 or not rua_cache_ts or (agora - rua_cache_ts) > CACHE_RUA_MAX:
+            precisa_atualizar_rua = True
+        if precisa_atualizar_rua:
+            novo_local = latlon_para_rua(lat, lon)
+            if novo_local:
+                rua_cache = novo_local
+                rua_cache_ts = agora
 
     if not rua_cache:
         rua_cache = latlon_para_rua(lat, lon)
         rua_cache_ts = agora
 
+    previsao = atualizar_previsao(
+        anterior, lat, lon, vel_final_ms, data.get("cog"), estado_movimento, timestamp
+    )
+
     salvar_posicao(nome, {
         "lat": lat,
         "lon": lon,
@@ -661,7 +1311,8 @@ def owntracks_webhook():
         "timestamp": timestamp,
         "rua_cache": rua_cache,
         "rua_cache_ts": rua_cache_ts,
-        "estado_movimento": estado_movimento
+        "estado_movimento": estado_movimento,
+        **previsao
     })
 
     config = {
@@ -689,25 +1340,223 @@ def onde_esta(nome):
     pos = buscar_posicao(nome.lower())
     if not pos:
         return jsonify({"erro": "Pessoa não encontrada"}), 404
+    if pos["lat"] is None or pos["lon"] is None:
+        return jsonify({"erro": "Pessoa sem posição"}), 404
+
+    # Em movimento a estimativa muda a cada PREVISAO_PASSO_SEG, então entra no ETag
+    estimativa = estimar_posicao(pos, int(time.time()))
+    versao = versao_regioes()
+    etag = gerar_etag("where", nome.lower(), pos["timestamp"], versao, *estimativa)
+    if nao_modificado(etag):
+        return resposta_condicional(None, etag)
+
+    resposta = cache_obter(("where", nome.lower()), etag)
+    if resposta is None:
+        # Respostas que não dependem de consultas externas não passam pelo pool
+        resposta = montar_resposta_where(nome, pos, estimativa, somente_local=True)
+        if resposta is not None:
+            cache_salvar(("where", nome.lower()), etag, resposta, CACHE_WHERE_TTL)
+    if resposta is None:
+        resposta = aguardar_resolucao_where(nome, pos, estimativa, etag)
+    if resposta is None:
+        # A resolução completa segue em segundo plano e alimenta o cache
+        resp = jsonify(montar_resposta_where_degradada(nome, pos, estimativa))
+        resp.cache_control.no_store = True
+        return resp
+
+    return resposta_condicional(resposta, etag)
 
+def montar_resposta_where(nome, pos, estimativa, somente_local=False):
+    """Com somente_local, retorna None se a resposta exigir consultas externas"""
     lat = pos["lat"]
     lon = pos["lon"]
-    local = determinar_local_prioritario(lat, lon)
+    lat_est, lon_est, raio_confianca = estimativa
     estado = pos.get("estado_movimento")
+    cog = pos.get("cog") or 0
+
+    resolvido = resolver_local_sem_consulta(nome.lower(), lat_est, lon_est, cog, estado)
+    if resolvido is None:
+        if somente_local:
+            return None
+        resolvido = resolver_local(nome.lower(), lat_est, lon_est, cog, estado)
+    local, poi_frente = resolvido
 
     if estado == "parado":
         texto = f"{nome.capitalize()} está parado próximo de {local}. Você quer mais detalhes?"
     else:
-        poi_frente = proximo_poi(lat, lon, pos.get("cog", 0))
         texto = f"{nome.capitalize()} está passando próximo de {local} em direção à {poi_frente}. Você quer mais detalhes?"
     
-    return jsonify({
+    return {
         "resposta": texto,
         "lat": lat,
         "lon": lon,
         "local": local,
-        "estado": estado
-    })
+        "estado": estado,
+        "estimativa": {
+            "lat": lat_est,
+            "lon": lon_est,
+            "raio_confianca_metros": raio_confianca
+        }
+    }
+
+LOCAL_RAIO_VALIDO = 150
+LOCAL_COG_TOLERANCIA = 45
+LOCAL_IDADE_MAX_SEG = 60 * 60
+
+def resolver_local_sem_consulta(nome, lat, lon, cog, estado):
+    """
+    Responde (local, poi_frente) só com dados locais: região salva e o último
+    local resolvido, enquanto a estimativa continuar dentro da área já resolvida
+    (e, em movimento, na mesma direção) e ele não tiver mais de
+    LOCAL_IDADE_MAX_SEG. Retorna None se for preciso consultar Overpass/Nominatim.
+    """
+    regioes_salvas = verificar_regioes(lat, lon)
+    anterior = buscar_local_resolvido(nome)
+
+    valido = (
+        anterior is not None and
+        time.time() - (anterior["resolvido_em"] or 0) <= LOCAL_IDADE_MAX_SEG and
+        distancia_metros(anterior["lat"], anterior["lon"], lat, lon) <= LOCAL_RAIO_VALIDO
+    )
+    if valido and estado != "parado":
+        diferenca = abs((cog - (anterior["cog"] or 0) + 180) % 360 - 180)
+        valido = anterior["poi_frente"] is not None and diferenca <= LOCAL_COG_TOLERANCIA
+
+    local = regioes_salvas[0] if regioes_salvas else (anterior["local"] if valido else None)
+    if local is None:
+        return None
+    if estado == "parado":
+        return local, None
+    if valido:
+        return local, anterior["poi_frente"]
+    return None
+
+def resolver_local(nome, lat, lon, cog, estado):
+    """Resolução completa com consultas externas; o resultado fica em local_resolvido"""
+    regioes_salvas = verificar_regioes(lat, lon)
+    local = regioes_salvas[0] if regioes_salvas else determinar_local_prioritario(lat, lon)
+    poi_frente = None if estado == "parado" else proximo_poi(lat, lon, cog)
+
+    # Dentro de uma região o nome dela prevalece; guarda-se só o POI à frente
+    salvar_local_resolvido(nome, lat, lon, cog, None if regioes_salvas else local, poi_frente)
+    return local, poi_frente
+
+# ==============================
+# Resolução com orçamento de latência
+# ==============================
+ORCAMENTO_WHERE_SEG = 0.5
+MAX_RESOLUCOES_PENDENTES = 16
+
+_executor_where = ThreadPoolExecutor(max_workers=4, thread_name_prefix="resolver-where")
+_resolucoes_where = {}
+_resolucoes_lock = threading.Lock()
+
+def iniciar_resolucao_where(nome, pos, estimativa, etag):
+    """
+    Dispara a resolução completa de /where, no máximo uma por pessoa: se já houver
+    uma em andamento (mesmo de um passo de estimativa anterior), ela é reaproveitada.
+    Retorna None quando MAX_RESOLUCOES_PENDENTES já estão na fila.
+    """
+    chave = nome.lower()
+    with _resolucoes_lock:
+        tarefa = _resolucoes_where.get(chave)
+        if tarefa is None:
+            if len(_resolucoes_where) >= MAX_RESOLUCOES_PENDENTES:
+                return None
+            tarefa = {
+                "etag": etag,
+                "inicio": time.perf_counter(),
+                "rastro": [],
+                "thread_id": None,
+                "amostradores": []
+            }
+            tarefa["futuro"] = _executor_where.submit(resolver_where, tarefa, nome, pos, estimativa)
+            _resolucoes_where[chave] = tarefa
+
+        amostrador = g.get("amostrador")
+        if amostrador:
+            tarefa["amostradores"].append(amostrador)
+            if tarefa["thread_id"]:
+                amostrador.acompanhar(tarefa["thread_id"])
+    return tarefa
+
+def resolver_where(tarefa, nome, pos, estimativa):
+    with _resolucoes_lock:
+        tarefa["thread_id"] = threading.get_ident()
+        for amostrador in tarefa["amostradores"]:
+            amostrador.acompanhar(tarefa["thread_id"])
+    vincular_rastro(tarefa["rastro"], tarefa["inicio"])
+    try:
+        resposta = montar_resposta_where(nome, pos, estimativa)
+        cache_salvar(("where", nome.lower()), tarefa["etag"], resposta, CACHE_WHERE_TTL)
+        return resposta
+    finally:
+        vincular_rastro(None, None)
+        with _resolucoes_lock:
+            _resolucoes_where.pop(nome.lower(), None)
+
+def aguardar_resolucao_where(nome, pos, estimativa, etag):
+    """
+    Espera a resolução completa até ORCAMENTO_WHERE_SEG e traz o rastro dela para
+    a requisição. Retorna None se o orçamento estourar (ou a fila estiver cheia).
+    """
+    tarefa = iniciar_resolucao_where(nome, pos, estimativa, etag)
+    if tarefa is None:
+        return None
+    pronto, _ = futures.wait([tarefa["futuro"]], timeout=ORCAMENTO_WHERE_SEG)
+    mesclar_rastro(tarefa["rastro"], tarefa["inicio"])
+    if not pronto:
+        return None
+    erro = tarefa["futuro"].exception()
+    if erro is not None:
+        print(f"Erro ao resolver /where: {erro}")
+        return None
+    if tarefa["etag"] == etag:
+        return tarefa["futuro"].result()
+    # Tarefa de um passo anterior: local_resolvido já foi atualizado por ela
+    resposta = montar_resposta_where(nome, pos, estimativa, somente_local=True)
+    if resposta is None:
+        # A estimativa já saiu da área resolvida: deixa a próxima resolução em andamento
+        iniciar_resolucao_where(nome, pos, estimativa, etag)
+    return resposta
+
+def montar_resposta_where_degradada(nome, pos, estimativa):
+    """
+    Resposta sem consultas externas, usada quando o orçamento estoura:
+    região salva, depois rua_cache, depois o último local resolvido.
+    """
+    lat_est, lon_est, raio_confianca = estimativa
+    estado = pos.get("estado_movimento")
+
+    regioes_salvas = verificar_regioes(lat_est, lon_est)
+    anterior = buscar_local_resolvido(nome.lower())
+    if regioes_salvas:
+        local = regioes_salvas[0]
+    elif pos.get("rua_cache"):
+        local = pos["rua_cache"]
+    elif anterior and anterior["local"]:
+        local = anterior["local"]
+    else:
+        local = "essa região"
+
+    if estado == "parado":
+        texto = f"{nome.capitalize()} está parado próximo de {local}. Você quer mais detalhes?"
+    else:
+        texto = f"{nome.capitalize()} está passando próximo de {local}. Você quer mais detalhes?"
+
+    return {
+        "resposta": texto,
+        "lat": pos["lat"],
+        "lon": pos["lon"],
+        "local": local,
+        "estado": estado,
+        "estimativa": {
+            "lat": lat_est,
+            "lon": lon_est,
+            "raio_confianca_metros": raio_confianca
+        },
+        "desatualizado": True
+    }
 
 # ==============================
 # /details/<nome> - APRIMORADO
@@ -720,12 +1569,27 @@ def detalhes(nome):
 
     tempo_seg = int(time.time()) - pos["timestamp"]
     tempo = formatar_tempo(tempo_seg)
+
+    # O texto depende do tempo decorrido, então o ETag inclui a redação atual
+    versao = versao_regioes()
+    etag = gerar_etag("details", nome.lower(), pos["timestamp"], versao, tempo)
+    if nao_modificado(etag):
+        return resposta_condicional(None, etag)
+
+    resposta = cache_obter(("details", nome.lower()), etag)
+    if resposta is None:
+        resposta = montar_resposta_detalhes(pos, tempo)
+        cache_salvar(("details", nome.lower()), etag, resposta, CACHE_DETALHES_TTL)
+
+    return resposta_condicional(resposta, etag)
+
+def montar_resposta_detalhes(pos, tempo):
     estado = pos.get("estado_movimento")
     lat = pos["lat"]
     lon = pos["lon"]
 
     regioes_atuais = verificar_regioes(lat, lon)
-    precisa_salvar = len(regioes_atuais) == 0 and estado == "parado"
+    precisa_salvar = len(regioes_atuais) == 0 and estado == "parado" and lat is not None and lon is not None
 
     if estado == "parado":
         estava = "estava" if tempo != "agora" else "está"
@@ -746,11 +1610,49 @@ def detalhes(nome):
     if precisa_salvar:
         texto += " Você quer salvar um nome personalizado para esse local?"
 
-    return jsonify({
+    return {
         "detalhes": texto,
         "precisa_salvar_regiao": precisa_salvar,
         "lat": lat,
         "lon": lon
+    }
+
+# ==============================
+# /perto/<nome> - pessoas próximas
+# ==============================
+RAIO_PERTO_PADRAO = 1000
+RAIO_PERTO_MAX = 50000
+
+@app.route("/perto/<nome>")
+def perto(nome):
+    pos = buscar_posicao(nome.lower())
+    if not pos:
+        return jsonify({"erro": "Pessoa não encontrada"}), 404
+    if pos["lat"] is None or pos["lon"] is None:
+        return jsonify({"erro": "Pessoa sem posição"}), 404
+
+    try:
+        raio = float(request.args.get("raio", RAIO_PERTO_PADRAO))
+    except ValueError:
+        return jsonify({"erro": "Raio inválido"}), 400
+    if not math.isfinite(raio):
+        return jsonify({"erro": "Raio inválido"}), 400
+    if raio <= 0 or raio > RAIO_PERTO_MAX:
+        return jsonify({"erro": f"Raio deve estar entre 0 e {RAIO_PERTO_MAX} metros"}), 400
+
+    pessoas = buscar_proximos(nome.lower(), pos["lat"], pos["lon"], raio)
+
+    if pessoas:
+        lista = ", ".join(f"{p['nome'].capitalize()} ({p['distancia_metros']} m)" for p in pessoas)
+        texto = f"Perto de {nome.capitalize()}: {lista}."
+    else:
+        texto = f"Ninguém está perto de {nome.capitalize()}."
+
+    return jsonify({
+        "resposta": texto,
+        "raio_metros": raio,
+        "total": len(pessoas),
+        "pessoas": pessoas
     })
 
 # ==============================
@@ -760,17 +1662,43 @@ def detalhes(nome):
 def salvar_regiao_manual():
     data = request.json or {}
     nome_regiao = data.get("nome")
+    poligono = data.get("poligono")
     lat = data.get("lat")
     lon = data.get("lon")
     raio = data.get("raio", 40)
 
-    if not nome_regiao or lat is None or lon is None:
+    if not nome_regiao:
         return jsonify({"erro": "Dados insuficientes"}), 400
+    if poligono is None and (lat is None or lon is None):
+        return jsonify({"erro": "Dados insuficientes"}), 400
+
+    if poligono is not None:
+        try:
+            pontos = [[float(p[0]), float(p[1])] for p in poligono]
+        except (TypeError, ValueError, IndexError):
+            return jsonify({"erro": "Polígono inválido"}), 400
+        if len(pontos) < 3:
+            return jsonify({"erro": "Polígono precisa de pelo menos 3 pontos"}), 400
+        if not all(coordenada_valida(p_lat, p_lon) for p_lat, p_lon in pontos):
+            return jsonify({"erro": "Polígono inválido"}), 400
+    else:
+        # float() aceita "nan" e estoura 1e400 para inf; a região salva quebraria o índice
+        try:
+            lat = float(lat)
+            lon = float(lon)
+            raio = float(raio)
+        except (TypeError, ValueError):
+            return jsonify({"erro": "Coordenadas inválidas"}), 400
+        if not coordenada_valida(lat, lon):
+            return jsonify({"erro": "Coordenadas inválidas"}), 400
+        if not math.isfinite(raio) or raio <= 0:
+            return jsonify({"erro": "Raio inválido"}), 400
 
     try:
-        lat = float(lat)
-        lon = float(lon)
-        salvar_regiao(nome_regiao, lat, lon, raio)
+        if poligono is not None:
+            salvar_regiao_poligono(nome_regiao, pontos)
+        else:
+            salvar_regiao(nome_regiao, lat, lon, raio)
         return jsonify({"status": "ok", "mensagem": f"Região '{nome_regiao}' salva com sucesso."})
     except Exception as e:
         return jsonify({"erro": "Falha ao salvar região", "detalhes": str(e)}), 500
@@ -785,9 +1713,15 @@ def listar_regioes():
             conn.row_factory = sqlite3.Row
             cur = conn.execute("SELECT * FROM regioes ORDER BY nome")
             regioes = cur.fetchall()
+        resultado = []
+        for r in regioes:
+            regiao = dict(r)
+            if regiao["poligono"]:
+                regiao["poligono"] = json.loads(regiao["poligono"])
+            resultado.append(regiao)
         return jsonify({
             "total": len(regioes),
-            "regioes": [dict(r) for r in regioes]
+            "regioes": resultado
         })
     except Exception as e:
         print("Erro ao listar regiões:", e)
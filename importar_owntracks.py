@@ -0,0 +1,406 @@
+"""
+Importação em massa de arquivos do OwnTracks Recorder (.rec) e exportações JSON.
+
+Aplica a mesma lógica de velocidade/movimento do webhook, grava em lotes
+grandes com executemany e registra checkpoints por arquivo, de modo que
+uma importação interrompida continua de onde parou.
+
+Uso:
+    python importar_owntracks.py rec/usuario/iphone/*.rec
+    python importar_owntracks.py export.json --nome iphone --geocodificar
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import time
+
+from app import (
+    DB_PATH, atualizar_previsao, calcular_movimento, distancia_metros,
+    geohash_codificar, latlon_para_rua
+)
+
+TAMANHO_LOTE = 5000
+TAMANHO_BLOCO = 1024 * 1024
+TAMANHO_CABECALHO = 4096
+
+# Início do objeto da API do Recorder: {"count": N, ..., "data": [
+INICIO_DATA = re.compile(
+    r'\{\s*(?:"[^"\\]*"\s*:\s*(?:"[^"\\]*"|[-\w.+]+)\s*,\s*)*"data"\s*:\s*\['
+)
+# Membro restante do objeto depois da lista "data": "chave":
+CHAVE_OBJETO = re.compile(r'"[^"\\]*"\s*:')
+
+SQL_UPSERT_POSICAO = """
+    INSERT INTO ultima_posicao (
+        nome, lat, lon, vel, cog, batt,
+        timestamp, rua_cache, rua_cache_ts, estado_movimento, geohash,
+        vel_norte, vel_leste, var_vel
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(nome) DO UPDATE SET
+        lat=excluded.lat,
+        lon=excluded.lon,
+        vel=excluded.vel,
+        cog=excluded.cog,
+        batt=excluded.batt,
+        timestamp=excluded.timestamp,
+        rua_cache=excluded.rua_cache,
+        rua_cache_ts=excluded.rua_cache_ts,
+        estado_movimento=excluded.estado_movimento,
+        geohash=excluded.geohash,
+        vel_norte=excluded.vel_norte,
+        vel_leste=excluded.vel_leste,
+        var_vel=excluded.var_vel
+    WHERE excluded.timestamp >= ultima_posicao.timestamp
+"""
+
+# ==============================
+# Banco de Dados
+# ==============================
+def init_checkpoints(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS importacao_checkpoint (
+            arquivo TEXT PRIMARY KEY,
+            posicao INTEGER NOT NULL,
+            atualizado_em INTEGER
+        )
+    """)
+    conn.commit()
+
+def buscar_checkpoint(conn, arquivo):
+    cur = conn.execute(
+        "SELECT posicao FROM importacao_checkpoint WHERE arquivo = ?", (arquivo,)
+    )
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+def gravar_lote(conn, arquivo, posicao, estados, pendentes):
+    """Grava as posições alteradas e o checkpoint na mesma transação"""
+    conn.executemany(SQL_UPSERT_POSICAO, [
+        (
+            nome,
+            estados[nome]["lat"],
+            estados[nome]["lon"],
+            estados[nome]["vel"],
+            estados[nome]["cog"],
+            estados[nome]["batt"],
+            estados[nome]["timestamp"],
+            estados[nome].get("rua_cache"),
+            estados[nome].get("rua_cache_ts"),
+            estados[nome].get("estado_movimento"),
+            geohash_codificar(estados[nome]["lat"], estados[nome]["lon"]),
+            estados[nome].get("vel_norte"),
+            estados[nome].get("vel_leste"),
+            estados[nome].get("var_vel")
+        )
+        for nome in pendentes
+    ])
+    conn.execute("""
+        INSERT INTO importacao_checkpoint (arquivo, posicao, atualizado_em)
+        VALUES (?, ?, ?)
+        ON CONFLICT(arquivo) DO UPDATE SET
+            posicao=excluded.posicao,
+            atualizado_em=excluded.atualizado_em
+    """, (arquivo, posicao, int(time.time())))
+    conn.commit()
+    pendentes.clear()
+
+def carregar_posicao(conn, nome):
+    cur = conn.execute("SELECT * FROM ultima_posicao WHERE nome = ?", (nome,))
+    row = cur.fetchone()
+    return dict(row) if row else None
+
+# ==============================
+# Leitura dos arquivos
+# ==============================
+def ler_rec(caminho, inicio):
+    """
+    Lê um arquivo .rec do Recorder a partir do byte `inicio`.
+    Cada linha tem o formato "<iso8601>\\t<tipo>\\t<json>".
+    Gera (mensagem, posição em bytes após a linha).
+    """
+    posicao = inicio
+    with open(caminho, "rb") as f:
+        f.seek(inicio)
+        for linha in f:
+            # Linha incompleta (Recorder ainda escrevendo): retomar depois
+            if not linha.endswith(b"\n"):
+                break
+            posicao += len(linha)
+            idx = linha.find(b"{")
+            if idx < 0:
+                continue
+            try:
+                msg = json.loads(linha[idx:])
+            except ValueError:
+                continue
+            yield msg, posicao
+
+def _valores_json(f):
+    """
+    Decodifica incrementalmente os valores de um arquivo JSON. Entra em listas de
+    nível superior e na lista "data" de {"data": [...]}, gerando um elemento por vez.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    fim_arquivo = False
+    # None (nível superior), "lista", "data" ou "cauda" (membros após "data")
+    estado = None
+    descartar = False
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+
+        # Folga para reconhecer cabeçalhos sem cortá-los no fim do bloco
+        if not fim_arquivo and len(buffer) - pos < TAMANHO_CABECALHO:
+            bloco = f.read(TAMANHO_BLOCO)
+            fim_arquivo = not bloco
+            buffer = buffer[pos:] + bloco
+            pos = 0
+            continue
+        if pos >= len(buffer):
+            return
+
+        c = buffer[pos]
+        if estado is None and c == "[":
+            estado = "lista"
+            pos += 1
+            continue
+        if estado is None and c == "{":
+            m = INICIO_DATA.match(buffer, pos)
+            if m:
+                estado = "data"
+                pos = m.end()
+                continue
+        if estado in ("lista", "data") and c == "]":
+            estado = None if estado == "lista" else "cauda"
+            pos += 1
+            continue
+        if estado == "cauda" and not descartar:
+            if c == "}":
+                estado = None
+                pos += 1
+                continue
+            m = CHAVE_OBJETO.match(buffer, pos)
+            if m:
+                descartar = True
+                pos = m.end()
+                continue
+
+        try:
+            valor, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # Valor cortado no fim do bloco: ler mais e tentar de novo
+            bloco = f.read(TAMANHO_BLOCO)
+            if not bloco:
+                raise
+            buffer = buffer[pos:] + bloco
+            pos = 0
+            continue
+
+        if descartar:
+            descartar = False
+            continue
+        yield valor
+
+def ler_json(caminho, inicio):
+    """
+    Lê uma exportação JSON (lista de mensagens, objeto {"data": [...]} da API
+    do Recorder ou uma mensagem por linha). A posição é o número de mensagens
+    consumidas; ao retomar, as `inicio` primeiras são puladas.
+    """
+    indice = 0
+    with open(caminho, encoding="utf-8") as f:
+        for valor in _valores_json(f):
+            if isinstance(valor, dict) and isinstance(valor.get("data"), list):
+                mensagens = valor["data"]
+            elif isinstance(valor, list):
+                mensagens = valor
+            else:
+                mensagens = [valor]
+
+            for msg in mensagens:
+                indice += 1
+                if indice <= inicio or not isinstance(msg, dict):
+                    continue
+                yield msg, indice
+
+def chave_checkpoint(caminho, nome_forcado=None):
+    """O checkpoint vale para o par arquivo + --nome: outro --nome reimporta o arquivo"""
+    arquivo = os.path.abspath(caminho)
+    return f"{arquivo}|{nome_forcado}" if nome_forcado else arquivo
+
+def nome_pelo_caminho(caminho):
+    """No Recorder os arquivos ficam em rec/<usuario>/<dispositivo>/AAAA-MM.rec"""
+    pasta = os.path.basename(os.path.dirname(os.path.abspath(caminho)))
+    return pasta.lower() or None
+
+def nome_da_mensagem(msg, nome_padrao):
+    """Mesmo critério do webhook: terceiro segmento do topic (owntracks/<usuario>/<dispositivo>)"""
+    partes = (msg.get("topic") or "").split("/")
+    if len(partes) < 3:
+        return nome_padrao
+    return partes[2].lower()
+
+# ==============================
+# Importação
+# ==============================
+def processar_mensagem(conn, msg, nome, estados):
+    """Aplica uma mensagem ao estado em memória de `nome`. Retorna True se aplicada."""
+    if msg.get("_type") != "location":
+        return False
+
+    lat = msg.get("lat")
+    lon = msg.get("lon")
+    timestamp = msg.get("tst")
+    if not nome or lat is None or lon is None or timestamp is None:
+        return False
+
+    if nome not in estados:
+        estados[nome] = carregar_posicao(conn, nome)
+    anterior = estados[nome]
+
+    # Mensagens já aplicadas ou mais antigas que a posição salva são ignoradas
+    if anterior and anterior["timestamp"] is not None and timestamp <= anterior["timestamp"]:
+        return False
+
+    vel_ot_ms = msg.get("vel", 0) or 0
+    vel_final_ms, estado_movimento, dist = calcular_movimento(
+        anterior, lat, lon, vel_ot_ms, timestamp
+    )
+    cog = msg.get("cog", 0)
+
+    # Mesma regra do webhook: rua_cache só vale a até 50 m de onde foi resolvida.
+    # Sem geocodificar aqui, a rua é descartada e a próxima chamada resolve de novo.
+    rua_cache = anterior.get("rua_cache") if anterior else None
+    rua_cache_ts = anterior.get("rua_cache_ts") if anterior else None
+    rua_origem = anterior.get("rua_origem") if anterior else None
+    if rua_cache and rua_origem is None and anterior["lat"] is not None and anterior["lon"] is not None:
+        rua_origem = (anterior["lat"], anterior["lon"])
+    if rua_cache and (
+        rua_origem is None or
+        (dist is not None and dist > 50) or
+        distancia_metros(rua_origem[0], rua_origem[1], lat, lon) > 50
+    ):
+        rua_cache = rua_cache_ts = rua_origem = None
+
+    estados[nome] = {
+        "lat": lat,
+        "lon": lon,
+        "vel": vel_final_ms,
+        "cog": cog,
+        "batt": msg.get("batt"),
+        "timestamp": timestamp,
+        "rua_cache": rua_cache,
+        "rua_cache_ts": rua_cache_ts,
+        "rua_origem": rua_origem,
+        "estado_movimento": estado_movimento,
+        **atualizar_previsao(
+            anterior, lat, lon, vel_final_ms, msg.get("cog"), estado_movimento, timestamp
+        )
+    }
+    return True
+
+def importar_arquivo(conn, caminho, estados, tamanho_lote, nome_forcado=None):
+    arquivo = chave_checkpoint(caminho, nome_forcado)
+    inicio = buscar_checkpoint(conn, arquivo)
+    # Só o .rec do Recorder tem a pasta do dispositivo no caminho; numa exportação
+    # JSON a pasta é arbitrária, então mensagens sem topic exigem --nome
+    if caminho.endswith(".rec"):
+        leitor = ler_rec
+        nome_padrao = nome_pelo_caminho(caminho)
+    else:
+        leitor = ler_json
+        nome_padrao = None
+
+    lidas = 0
+    aplicadas = 0
+    sem_nome = 0
+    posicao = inicio
+    pendentes = set()
+    tocados = set()
+
+    for msg, posicao in leitor(caminho, inicio):
+        lidas += 1
+        nome = nome_forcado or nome_da_mensagem(msg, nome_padrao)
+        if not nome:
+            sem_nome += 1
+        elif processar_mensagem(conn, msg, nome, estados):
+            aplicadas += 1
+            pendentes.add(nome)
+            tocados.add(nome)
+        if lidas % tamanho_lote == 0:
+            gravar_lote(conn, arquivo, posicao, estados, pendentes)
+            print(f"{caminho}: {lidas} mensagens lidas")
+
+    gravar_lote(conn, arquivo, posicao, estados, pendentes)
+    print(f"{caminho}: {lidas} lidas, {aplicadas} aplicadas, {lidas - aplicadas} ignoradas")
+    if sem_nome:
+        print(f"{caminho}: {sem_nome} mensagens sem topic ignoradas (use --nome)")
+    return tocados
+
+def geocodificar(conn, nomes):
+    """Geocodificação adiada: uma consulta por pessoa, na posição final importada"""
+    agora = int(time.time())
+    atualizacoes = []
+    for nome in sorted(nomes):
+        pos = carregar_posicao(conn, nome)
+        if not pos:
+            continue
+        rua = latlon_para_rua(pos["lat"], pos["lon"])
+        if rua:
+            atualizacoes.append((rua, agora, nome))
+    conn.executemany(
+        "UPDATE ultima_posicao SET rua_cache = ?, rua_cache_ts = ? WHERE nome = ?",
+        atualizacoes
+    )
+    conn.commit()
+    print(f"Geocodificação: {len(atualizacoes)} de {len(nomes)} posições atualizadas")
+
+def inteiro_positivo(valor):
+    numero = int(valor)
+    if numero <= 0:
+        raise argparse.ArgumentTypeError("deve ser um inteiro maior que zero")
+    return numero
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Importa arquivos .rec e exportações JSON do OwnTracks Recorder"
+    )
+    parser.add_argument("arquivos", nargs="+", help="Arquivos .rec ou .json")
+    parser.add_argument("--nome", help="Nome usado para todas as mensagens (ignora o topic)")
+    parser.add_argument("--lote", type=inteiro_positivo, default=TAMANHO_LOTE,
+                        help="Mensagens por transação")
+    parser.add_argument("--geocodificar", action="store_true",
+                        help="Atualiza rua_cache na posição final de cada pessoa ao terminar")
+    parser.add_argument("--reiniciar", action="store_true",
+                        help="Descarta os checkpoints dos arquivos informados")
+    args = parser.parse_args()
+
+    with sqlite3.connect(DB_PATH) as conn:
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous = NORMAL")
+        init_checkpoints(conn)
+
+        if args.reiniciar:
+            conn.executemany(
+                "DELETE FROM importacao_checkpoint WHERE arquivo = ?",
+                [(chave_checkpoint(c, args.nome),) for c in args.arquivos]
+            )
+            conn.commit()
+
+        estados = {}
+        tocados = set()
+        # Arquivos do Recorder são mensais (AAAA-MM.rec): ordenar mantém a ordem cronológica
+        for caminho in sorted(args.arquivos):
+            tocados |= importar_arquivo(conn, caminho, estados, args.lote, args.nome)
+
+        if args.geocodificar and tocados:
+            geocodificar(conn, tocados)
+
+if __name__ == "__main__":
+    main()